@@ -1,21 +1,49 @@
 import os
+from typing import Optional
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     # App Settings
     APP_NAME: str = "AI Face Recognition Service"
     API_V1_STR: str = "/api/v1"
+    LOG_LEVEL: str = "INFO"  # Set to WARNING in production to skip per-request log records entirely
     
     # Face Recognition Settings
     RECOGNITION_THRESHOLD: float = 0.45  # Tuned for Cosine distance
+    EARLY_EXIT_THRESHOLD: float = 0.08  # A stored match this close ends the search without scoring session embeddings
     MODEL_NAME: str = "VGG-Face"
     DISTANCE_METRIC: str = "cosine"
     DETECTOR_BACKEND: str = "opencv"  # Primary detector (opencv, retinaface, ssd, etc.)
     # Note: Service uses multi-strategy detection with automatic fallback:
     # 1. opencv (fast) -> 2. retinaface (accurate) -> 3. opencv relaxed (fallback)
+    MIN_FACE_SIZE: int = 50  # Faces narrower or shorter than this many original-photo pixels are rejected as unreliable
+    LOW_CONTRAST_STD: float = 25.0  # Images with a lower pixel standard deviation try retinaface before opencv
+    FORCE_DETECTOR: str = ""  # Use only this detector backend, strict then relaxed (e.g. to pin detection in CI)
+    PARALLEL_DETECTION: bool = False  # Run all detection strategies concurrently instead of one after another
+    DECODE_MAX_SIZE: int = 1024  # JPEGs are decoded at the smallest power-of-two scale still covering this size
+    DETECTION_MAX_SIZE: int = 800  # Decoded images are downscaled to this longer side before detection (0 disables)
+    NO_FACE_CACHE_MAX_PHOTOS: int = 4096  # Student photos remembered as having no detectable face, so detection isn't rerun on every mark
+    PHOTO_EMBEDDING_CACHE_MAX_MB: int = 64  # Memory budget for student embeddings shared across sessions
+    EMBEDDING_BATCH_SIZE: int = 32  # Faces per model forward pass when extracting student embeddings
+    QUANTIZED_MATCHING: bool = False  # Scan pre-computed embeddings as int8, rescore the best match in float32
+    
+    # Session Cache Settings
+    SESSION_CACHE_MAX_SESSIONS: int = 64  # Least recently used sessions are evicted beyond this
+    SESSION_CACHE_TTL_SECONDS: int = 4 * 3600  # Session embeddings are dropped this long after creation
+    
+    # Firestore Cache Settings
+    STUDENTS_CACHE_MAX_CLASSES: int = 256  # Least recently used class rosters are evicted beyond this
+    STUDENTS_CACHE_TTL_SECONDS: int = 60  # Class rosters are re-fetched from Firestore after this long
+    
+    # Audit Settings
+    AUDIT_TRAIL_ENABLED: bool = False  # Save each request's session metadata and student list to TEMP_IMAGES_DIR
+    AUDIT_SAVE_IMAGES: bool = False  # Save each uploaded image to TEMP_IMAGES_DIR
     
     # Storage Settings
     EMBEDDINGS_DIR: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), "embeddings")
+    EMBEDDINGS_MATRIX_PATH: Optional[str] = None  # Raw float32 matrix, one row per student (default: EMBEDDINGS_DIR/embeddings.bin)
+    EMBEDDINGS_IDS_PATH: Optional[str] = None  # Dimension and student id of each row (default: EMBEDDINGS_DIR/embedding_ids.json)
     TEMP_IMAGES_DIR: str = os.path.join(os.path.dirname(os.path.dirname(__file__)), "temp_images")
     
     # Firebase Settings
@@ -23,6 +51,15 @@ class Settings(BaseSettings):
     
     class Config:
         case_sensitive = True
+    
+    @model_validator(mode="after")
+    def _resolve_embedding_paths(self) -> "Settings":
+        """Place the embedding store in EMBEDDINGS_DIR unless its files are set explicitly."""
+        if self.EMBEDDINGS_MATRIX_PATH is None:
+            self.EMBEDDINGS_MATRIX_PATH = os.path.join(self.EMBEDDINGS_DIR, "embeddings.bin")
+        if self.EMBEDDINGS_IDS_PATH is None:
+            self.EMBEDDINGS_IDS_PATH = os.path.join(self.EMBEDDINGS_DIR, "embedding_ids.json")
+        return self
 
 settings = Settings()
 
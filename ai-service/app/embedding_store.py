@@ -0,0 +1,233 @@
+"""
+Embedding Store Module
+
+Keeps every pre-computed face embedding in a single (N, D) matrix of raw
+little-endian float32 values on disk, memory-mapped at load time, with a JSON
+sidecar holding the dimensionality and the student id of each row.
+"""
+
+import os
+import json
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DTYPE = np.dtype("<f4")
+
+
+class EmbeddingStore:
+    """
+    Single-file embedding storage.
+
+    Features:
+    - One memory-mapped matrix: the OS pages in only the rows that are read
+    - Row lookup by student id through `id_to_row`
+    - Shared across worker processes: every worker maps the same read-only pages
+    - Append-only writes: new rows are appended to the matrix file, then the
+      sidecar is replaced atomically, so readers never see a row without its id
+    - Serialized writers: add_many holds an exclusive lock on a lock file next to
+      the sidecar, so concurrent precompute runs never overwrite each other's rows
+    """
+
+    def __init__(self, matrix_path: str, ids_path: str, data: np.ndarray, ids: List[str]):
+        """
+        Wrap an already loaded matrix and its ids.
+
+        Args:
+            matrix_path: Raw float32 matrix file
+            ids_path: JSON sidecar file
+            data: (N, D) float32 matrix, one L2-normalized embedding per row
+            ids: Student id of each row
+        """
+        self.matrix_path = matrix_path
+        self.ids_path = ids_path
+        self.data = data
+        self.ids = ids
+        self.id_to_row: Dict[str, int] = {student_id: row for row, student_id in enumerate(ids)}
+        self.ids_mtime: Optional[int] = None  # Sidecar mtime when this store was loaded
+        self._thread_lock = threading.RLock()  # Serializes writers within this process
+        self._lock_depth = 0  # Nesting level of write_lock() in the thread holding _thread_lock
+
+    @classmethod
+    def open(cls, matrix_path: str, ids_path: str) -> "EmbeddingStore":
+        """
+        Memory-map a store, or return an empty store if its files don't exist yet.
+
+        Args:
+            matrix_path: Raw float32 matrix file
+            ids_path: JSON sidecar file
+
+        Returns:
+            EmbeddingStore backed by the files on disk
+        """
+        for path in (matrix_path, ids_path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        if not (os.path.exists(matrix_path) and os.path.exists(ids_path)):
+            return cls(matrix_path, ids_path, np.empty((0, 0), dtype=DTYPE), [])
+
+        store = cls(matrix_path, ids_path, np.empty((0, 0), dtype=DTYPE), [])
+        store.reload()
+        return store
+
+    def reload(self):
+        """Re-read the sidecar and re-map the matrix to match it."""
+        if not (os.path.exists(self.matrix_path) and os.path.exists(self.ids_path)):
+            return
+
+        ids_mtime = os.stat(self.ids_path).st_mtime_ns
+        with open(self.ids_path, "r") as f:
+            meta = json.load(f)
+        ids = meta["ids"]
+        data = self._map(self.matrix_path, len(ids), meta["dim"])
+
+        if data is None:
+            logger.error(f"Embedding store is inconsistent ({len(ids)} ids, matrix file too short), ignoring it")
+            return
+
+        self.data = data
+        self.ids = ids
+        self.id_to_row = {student_id: row for row, student_id in enumerate(ids)}
+        self.ids_mtime = ids_mtime
+
+    @contextmanager
+    def write_lock(self):
+        """
+        Hold an exclusive lock shared by every process writing to this store.
+
+        Re-entrant: add_many can be called while the lock is already held, so
+        callers can check and write the store as one step.
+        """
+        with self._thread_lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.ids_path + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def is_stale(self) -> bool:
+        """Check whether another process has written to the store since it was loaded."""
+        try:
+            return os.stat(self.ids_path).st_mtime_ns != self.ids_mtime
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _map(matrix_path: str, rows: int, dim: int) -> Optional[np.ndarray]:
+        """
+        Memory-map the first `rows` rows of a raw matrix file.
+
+        Rows past the end of the sidecar (left by an interrupted append) are ignored.
+
+        Returns:
+            Read-only (rows, dim) array, or None if the file holds fewer rows
+        """
+        if os.path.getsize(matrix_path) < rows * dim * DTYPE.itemsize:
+            return None
+        if rows == 0:
+            return np.empty((0, dim), dtype=DTYPE)
+        return np.memmap(matrix_path, dtype=DTYPE, mode="r", shape=(rows, dim))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, student_id: str) -> bool:
+        return student_id in self.id_to_row
+
+    def __getitem__(self, student_id: str) -> np.ndarray:
+        return self.data[self.id_to_row[student_id]]
+
+    def get(self, student_id: str) -> Optional[np.ndarray]:
+        """Return the embedding row for a student, or None if not stored."""
+        row = self.id_to_row.get(student_id)
+        return None if row is None else self.data[row]
+
+    def add_many(self, student_ids: List[str], vectors: np.ndarray):
+        """
+        Insert or replace embeddings and persist the store.
+
+        Existing rows are overwritten in place; new rows are appended. The
+        sidecar is re-read under the write lock first, so rows appended by
+        another process since this store was loaded are kept.
+
+        Args:
+            student_ids: Student id of each vector
+            vectors: (K, D) matrix of L2-normalized embeddings
+        """
+        vectors = np.asarray(vectors, dtype=DTYPE)
+        with self.write_lock():
+            # Not is_stale(): two writes within one mtime tick would look unchanged
+            self.reload()
+            self._add_many(student_ids, vectors)
+
+    def _add_many(self, student_ids: List[str], vectors: np.ndarray):
+        """Write rows for add_many; the caller holds the write lock and has reloaded the sidecar."""
+        dim = vectors.shape[1] if len(self.ids) == 0 else self.data.shape[1]
+        if vectors.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {dim}")
+
+        ids = list(self.ids)
+        id_to_row = dict(self.id_to_row)
+        replaced = {}
+        appended = []
+        for student_id, vector in zip(student_ids, vectors):
+            row = id_to_row.get(student_id)
+            if row is None:
+                id_to_row[student_id] = len(ids)
+                ids.append(student_id)
+                appended.append(vector)
+            elif row < len(self.ids):
+                replaced[row] = vector
+            else:
+                appended[row - len(self.ids)] = vector
+
+        row_bytes = dim * DTYPE.itemsize
+        mode = "r+b" if os.path.exists(self.matrix_path) else "w+b"
+        with open(self.matrix_path, mode) as f:
+            for row, vector in replaced.items():
+                f.seek(row * row_bytes)
+                f.write(vector.tobytes())
+            if appended:
+                # Drop any rows left behind by an interrupted append before writing new ones;
+                # never below the sidecar's row count, which readers may have mapped
+                f.seek(len(self.ids) * row_bytes)
+                f.truncate()
+                f.write(np.stack(appended).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._write_ids(ids, dim)
+        self.data = self._map(self.matrix_path, len(ids), dim)
+        self.ids = ids
+        self.id_to_row = id_to_row
+
+    def add(self, student_id: str, vector: np.ndarray):
+        """Insert or replace a single embedding and persist the store."""
+        self.add_many([student_id], np.asarray(vector, dtype=DTYPE)[None, :])
+
+    def _write_ids(self, ids: List[str], dim: int):
+        """Atomically replace the sidecar."""
+        tmp_ids_path = self.ids_path + ".tmp"
+        with open(tmp_ids_path, "w") as f:
+            json.dump({"dim": dim, "ids": ids}, f)
+        os.replace(tmp_ids_path, self.ids_path)
+        self.ids_mtime = os.stat(self.ids_path).st_mtime_ns
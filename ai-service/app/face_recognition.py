@@ -7,17 +7,78 @@ compatibility and reliability across various image conditions.
 
 import os
 import pickle
-import base64
+import hashlib
+import cv2
 import numpy as np
 import logging
-from typing import List, Tuple, Optional, Dict
+import threading
+from typing import List, Tuple, Optional, Dict, NamedTuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from cachetools import LRUCache, TTLCache
 from io import BytesIO
 from PIL import Image
 from deepface import DeepFace
+from deepface.modules import detection
 from app.config import settings
+from app.embedding_store import EmbeddingStore
+from app import face_recognition_kernels
 
 logger = logging.getLogger(__name__)
 
+# Optional accelerators: SIMD base64 and libjpeg-turbo decoding, with stdlib/PIL fallbacks
+try:
+    from pybase64 import b64decode
+except ImportError:
+    from base64 import b64decode
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbo_jpeg = TurboJPEG()
+except Exception:  # Package missing or libturbojpeg not installed
+    _turbo_jpeg = None
+
+# Optional FAISS index for scanning pre-computed embeddings
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Optional SimSIMD kernels for cosine distances (AVX-512 / NEON)
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+# Detection strategies in order of preference: (detector_backend, enforce_detection)
+DETECTION_STRATEGIES = (
+    ('opencv', True),      # Fast, works for most clear images
+    ('retinaface', True),  # Accurate, handles challenging conditions
+    ('opencv', False),     # Relaxed, last resort for edge cases
+)
+
+# Order used for low-contrast images, where the opencv Haar cascade rarely finds a face
+LOW_CONTRAST_STRATEGIES = (
+    ('retinaface', True),
+    ('opencv', True),
+    ('opencv', False),
+)
+
+
+def decode_base64_image(image: str) -> bytes:
+    """Decode a base64 image, with or without a data URI prefix."""
+    prefix, _, data = image.partition(",")
+    return b64decode(data or prefix)
+
+
+class StoredIndex(NamedTuple):
+    """Search structures built from one version of the pre-computed embedding matrix."""
+    id_to_row: Dict[str, int]  # Row of each student id in matrix
+    matrix: np.ndarray  # (N, D) float32 matrix the structures below were built from
+    quantized: Optional[np.ndarray]  # int8 copy of matrix (QUANTIZED_MATCHING)
+    scale: Optional[np.ndarray]  # Single scale of the whole quantized matrix
+    faiss_index: Optional[object]  # Inner-product index over matrix (when faiss is installed)
+
+
 class FaceRecognizer:
     """
     Face recognizer with optimized caching and multi-strategy detection.
@@ -30,30 +91,144 @@ class FaceRecognizer:
     
     def __init__(self):
         """Initialize the face recognizer and load pre-computed embeddings."""
-        self.embeddings: Dict[str, List[float]] = {}  # Pre-computed embeddings from disk
-        self.session_cache: Dict[str, Dict[str, List[float]]] = {}  # Session-based cache
+        self.embeddings: Optional[EmbeddingStore] = None  # Pre-computed embeddings from disk (L2-normalized)
+        # Session-based cache (L2-normalized), bounded so forgotten sessions can't leak memory
+        self.session_cache: TTLCache = TTLCache(
+            maxsize=settings.SESSION_CACHE_MAX_SESSIONS,
+            ttl=settings.SESSION_CACHE_TTL_SECONDS
+        )
+        self._session_cache_lock = threading.Lock()  # TTLCache is not thread-safe
+        # Serializes student extraction per session; bounded like session_cache so evicted sessions don't leave locks behind
+        self._session_locks: TTLCache = TTLCache(
+            maxsize=settings.SESSION_CACHE_MAX_SESSIONS,
+            ttl=settings.SESSION_CACHE_TTL_SECONDS
+        )
+        self._session_locks_guard = threading.Lock()
+        # Digests of student photos with no detectable face, so they don't go through the detectors on every mark
+        self._no_face_photos: LRUCache = LRUCache(maxsize=settings.NO_FACE_CACHE_MAX_PHOTOS)
+        self._no_face_photos_lock = threading.Lock()  # LRUCache is not thread-safe
+        # Embeddings of student photos keyed by photo digest, shared by every session of a class
+        self._photo_embeddings: LRUCache = LRUCache(
+            maxsize=settings.PHOTO_EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+            getsizeof=lambda embedding: embedding.nbytes
+        )
+        self._photo_embeddings_lock = threading.Lock()
+        # Built off to the side and published whole, so a request never sees a half-built index
+        self._stored_index: Optional[StoredIndex] = None
+        self._stored_index_lock = threading.Lock()
+        self._model = None  # Recognition model, built once by warmup()
+        # Decodes student photos ahead of face detection (PIL / OpenCV / TurboJPEG release the GIL)
+        self._decode_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-decode")
+        # Extracts the uploaded image's embedding while the request thread extracts missing students;
+        # requests with nothing to extract embed the upload inline
+        self._upload_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="upload-embed")
+        self._detection_pool = (
+            ThreadPoolExecutor(max_workers=len(DETECTION_STRATEGIES), thread_name_prefix="face-detect")
+            if settings.PARALLEL_DETECTION else None
+        )
         self.load_embeddings()
 
+    def warmup(self):
+        """
+        Build the recognition model and detectors ahead of the first request.
+        
+        DeepFace caches built models and detectors at module level, so doing this
+        once at startup moves weight loading and the first graph trace out of
+        the request path.
+        """
+        self._model = DeepFace.build_model(settings.MODEL_NAME)
+        dummy = np.zeros((224, 224, 3), dtype=np.uint8)
+        
+        for backend in ('opencv', 'retinaface'):
+            try:
+                DeepFace.extract_faces(img_path=dummy, detector_backend=backend, enforce_detection=False)
+            except Exception as e:
+                logger.warning(f"Failed to warm up {backend} detector: {e}")
+        
+        # Trace the same batched model call that uploads and student photos go through
+        self._embed_faces([np.zeros((1, *self._model.input_shape, 3), dtype=np.float32)])
+        if len(self.embeddings):
+            face_recognition_kernels.warmup(self.embeddings.data.shape[1])
+        logger.info(f"Face recognition model {settings.MODEL_NAME} and detectors loaded")
+
     def load_embeddings(self):
-        """Load pre-computed embeddings from disk for fast recognition."""
-        self.embeddings = {}
-        if not os.path.exists(settings.EMBEDDINGS_DIR):
-            os.makedirs(settings.EMBEDDINGS_DIR)
+        """Memory-map pre-computed embeddings from disk for fast recognition."""
+        self.embeddings = EmbeddingStore.open(settings.EMBEDDINGS_MATRIX_PATH, settings.EMBEDDINGS_IDS_PATH)
+        if len(self.embeddings) == 0:
+            self._migrate_pickled_embeddings()
+        else:
+            self._renormalize_stored_embeddings()
+        
+        logger.info(f"Loaded {len(self.embeddings)} pre-computed embeddings from disk")
+
+    def reload_embeddings_if_changed(self):
+        """
+        Pick up embeddings written by precompute_embeddings.py without a restart.
+        
+        The store is append-only, so row indices taken from the previous store
+        stay valid for requests already in flight.
+        """
+        if self.embeddings.is_stale():
+            self.embeddings = EmbeddingStore.open(settings.EMBEDDINGS_MATRIX_PATH, settings.EMBEDDINGS_IDS_PATH)
+            logger.info(f"Reloaded {len(self.embeddings)} pre-computed embeddings from disk")
+
+    def _renormalize_stored_embeddings(self):
+        """Re-normalize any stored rows that are not unit length (e.g. written by an older version)."""
+        norms = np.linalg.norm(self.embeddings.data, axis=1)
+        drifted = np.flatnonzero(np.abs(norms - 1.0) > 1e-4)
+        if len(drifted) == 0:
             return
+        
+        vectors = np.array(self.embeddings.data[drifted], dtype=np.float32)
+        vectors /= np.where(norms[drifted] > 0, norms[drifted], 1.0)[:, None]
+        self.embeddings.add_many([self.embeddings.ids[row] for row in drifted], vectors)
+        logger.info(f"Re-normalized {len(drifted)} stored embeddings")
 
-        for filename in os.listdir(settings.EMBEDDINGS_DIR):
-            if filename.endswith(".pkl"):
-                student_id = filename[:-4]
-                try:
-                    with open(os.path.join(settings.EMBEDDINGS_DIR, filename), "rb") as f:
-                        embedding = pickle.load(f)
-                        self.embeddings[student_id] = embedding
-                except Exception as e:
-                    logger.error(f"Failed to load embedding for {student_id}: {e}")
+    def _migrate_pickled_embeddings(self):
+        """
+        Import legacy one-file-per-student .pkl embeddings into the embedding store.
         
-        logger.info(f"Loaded {len(self.embeddings)} pre-computed embeddings from disk")
+        Imported files are moved to EMBEDDINGS_DIR/legacy/, so deleting the store
+        later doesn't bring their (possibly outdated) embeddings back. The import
+        runs under the store's write lock, so when several workers start at once
+        only the first one imports the files.
+        """
+        if not any(filename.endswith(".pkl") for filename in os.listdir(settings.EMBEDDINGS_DIR)):
+            return
+        
+        with self.embeddings.write_lock():
+            self.embeddings.reload()
+            if len(self.embeddings):
+                return  # Another worker imported them while this one waited for the lock
+            
+            student_ids = []
+            filenames = []
+            vectors = []
+            for filename in os.listdir(settings.EMBEDDINGS_DIR):
+                if filename.endswith(".pkl"):
+                    student_id = filename[:-4]
+                    try:
+                        with open(os.path.join(settings.EMBEDDINGS_DIR, filename), "rb") as f:
+                            embedding = pickle.load(f)
+                        vectors.append(self._normalize(embedding))
+                        student_ids.append(student_id)
+                        filenames.append(filename)
+                    except Exception as e:
+                        logger.error(f"Failed to load embedding for {student_id}: {e}")
+            
+            if not student_ids:
+                return
+            self.embeddings.add_many(student_ids, np.stack(vectors))
+            legacy_dir = os.path.join(settings.EMBEDDINGS_DIR, "legacy")
+            os.makedirs(legacy_dir, exist_ok=True)
+            for filename in filenames:
+                try:
+                    os.replace(os.path.join(settings.EMBEDDINGS_DIR, filename), os.path.join(legacy_dir, filename))
+                except FileNotFoundError:
+                    pass  # Already moved by another process
+        logger.info(f"Migrated {len(student_ids)} .pkl embeddings into the embedding store (originals moved to {legacy_dir})")
 
-    def _base64_to_image(self, base64_string: str) -> np.ndarray:
+    def _base64_to_image(self, base64_string: str) -> Tuple[np.ndarray, float]:
         """
         Convert base64 string to numpy array.
         
@@ -61,175 +236,647 @@ class FaceRecognizer:
             base64_string: Base64 encoded image (with or without data URI prefix)
             
         Returns:
-            Image as numpy array in RGB format
+            (image, scale): read-only RGB image and its size relative to the encoded image (see _bytes_to_image)
         """
-        if "," in base64_string:
-            base64_string = base64_string.split(",")[1]
+        return self._bytes_to_image(decode_base64_image(base64_string))
+
+    def _bytes_to_image(self, image_data: bytes) -> Tuple[np.ndarray, float]:
+        """
+        Convert encoded image bytes (JPEG, PNG, ...) to numpy array.
+        
+        Images whose longer side exceeds DETECTION_MAX_SIZE are downscaled,
+        since detection cost grows with pixel count. The returned scale lets
+        MIN_FACE_SIZE be checked in the photo's original pixels.
+        
+        Args:
+            image_data: Raw image file contents
+            
+        Returns:
+            (image, scale): read-only RGB image, and its longer side divided by the encoded image's (1.0 if not downscaled)
+        """
+        image, source_size = self._decode_bytes(image_data)
+        image = self._limit_size(image)
+        return image, max(image.shape[:2]) / source_size
+
+    def _decode_bytes(self, image_data: bytes) -> Tuple[np.ndarray, int]:
+        """
+        Decode image bytes at full size (JPEGs at the DECODE_MAX_SIZE draft scale).
+        
+        Returns:
+            (image, source_size): RGB image and the longer side of the encoded image
+        """
+        is_jpeg = image_data[:2] == b"\xff\xd8"
+        if _turbo_jpeg is not None and is_jpeg:
+            try:
+                width, height, _, _ = _turbo_jpeg.decode_header(image_data)
+                return self._decode_jpeg_turbo(image_data), max(width, height)
+            except Exception as e:
+                logger.debug("TurboJPEG decode failed, falling back to PIL: %s", e)
+        
+        if not is_jpeg:
+            # PNG and friends gain nothing from draft(); OpenCV decodes them without PIL's overhead
+            image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), max(image.shape[:2])
         
-        image_data = base64.b64decode(base64_string)
         image = Image.open(BytesIO(image_data))
+        source_size = max(image.size)  # Header size, before draft() shrinks it
+        # Let libjpeg downscale by a power of two while decoding large JPEGs
+        image.draft("RGB", (settings.DECODE_MAX_SIZE, settings.DECODE_MAX_SIZE))
         
         if image.mode != "RGB":
             image = image.convert("RGB")
-            
-        return np.array(image)
+        
+        # asarray wraps PIL's pixel buffer instead of copying it a second time;
+        # the result is read-only, which DeepFace's detectors never write to
+        return np.asarray(image), source_size
+
+    @staticmethod
+    def _limit_size(image: np.ndarray) -> np.ndarray:
+        """
+        Downscale an image so its longer side is at most DETECTION_MAX_SIZE.
+        
+        Returns:
+            Read-only image, resized with INTER_AREA if it was too large
+        """
+        height, width = image.shape[:2]
+        scale = settings.DETECTION_MAX_SIZE / max(height, width)
+        if settings.DETECTION_MAX_SIZE > 0 and scale < 1:
+            resized = (max(1, round(width * scale)), max(1, round(height * scale)))
+            logger.debug("Downscaling image from %dx%d to %dx%d", width, height, *resized)
+            image = cv2.resize(image, resized, interpolation=cv2.INTER_AREA)
+        image.setflags(write=False)
+        return image
+
+    @staticmethod
+    def _image_key(base64_string: str) -> bytes:
+        """Short digest of a base64 photo, used to key the no-face and photo-embedding caches."""
+        return hashlib.blake2b(base64_string.encode(), digest_size=16).digest()
+
+    @staticmethod
+    def _decode_jpeg_turbo(image_data: bytes) -> np.ndarray:
+        """
+        Decode a JPEG with libjpeg-turbo, downscaling like Image.draft does.
+        
+        Returns:
+            Image as numpy array in RGB format
+        """
+        width, height, _, _ = _turbo_jpeg.decode_header(image_data)
+        scale = min(width // settings.DECODE_MAX_SIZE, height // settings.DECODE_MAX_SIZE)
+        denominator = next((d for d in (8, 4, 2) if scale >= d), 1)
+        return _turbo_jpeg.decode(image_data, pixel_format=TJPF_RGB, scaling_factor=(1, denominator))
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        """
+        Convert an embedding to an L2-normalized float32 vector.
+        
+        Once normalized, cosine distance reduces to 1 - dot product.
+        """
+        vector = np.array(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def _get_stored_index(self) -> StoredIndex:
+        """
+        Return the search structures for the current pre-computed embeddings.
+        
+        The int8 copy used by QUANTIZED_MATCHING and the FAISS index are
+        rebuilt whenever the embedding store has been rewritten. Callers take
+        one snapshot per request and use it throughout, so row numbers always
+        index the matrix and int8 copy they were looked up with.
+        """
+        store = self.embeddings
+        # Ids before data: the store only grows, so every id read here has a row in the matrix
+        id_to_row = store.id_to_row
+        matrix = store.data
+        index = self._stored_index
+        if index is not None and index.matrix is matrix and index.id_to_row is id_to_row:
+            return index
+        with self._stored_index_lock:
+            index = self._stored_index
+            if index is None or index.matrix is not matrix or index.id_to_row is not id_to_row:
+                index = self._build_stored_index(id_to_row, matrix)
+                self._stored_index = index
+        return index
 
     @staticmethod
-    def compute_cosine_distance(embedding1: List[float], embedding2: List[float]) -> float:
+    def _build_stored_index(id_to_row: Dict[str, int], matrix: np.ndarray) -> StoredIndex:
         """
-        Calculate cosine distance between two embeddings.
+        Build the int8 copy or FAISS index for a matrix of pre-computed embeddings.
+        
+        QUANTIZED_MATCHING takes precedence: with it enabled no FAISS index is
+        built and classes are scanned as int8. Otherwise the index is a flat
+        inner-product index: a class is a small subset of the matrix, so exact
+        search over it costs little and never misses the best student.
+        """
+        quantized = scale = faiss_index = None
+        if settings.QUANTIZED_MATCHING and len(matrix):
+            quantized, scale = FaceRecognizer._quantize(np.asarray(matrix), per_vector=False)
+        elif faiss is not None and len(matrix):
+            faiss_index = faiss.IndexFlatIP(matrix.shape[1])
+            faiss_index.add(np.ascontiguousarray(matrix, dtype=np.float32))
+        return StoredIndex(id_to_row, matrix, quantized, scale, faiss_index)
+
+    @staticmethod
+    def _quantize(vectors: np.ndarray, per_vector: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Symmetrically quantize vectors to int8.
+        
+        Rows of the stored matrix are all unit length, so one scale for the whole
+        matrix loses little precision and turns scoring into an integer dot
+        product followed by a single multiply.
         
         Args:
-            embedding1: First face embedding
-            embedding2: Second face embedding
+            vectors: Single vector (D,) or matrix (N, D) of float embeddings
+            per_vector: One scale per vector if True, one scale for the whole array otherwise
             
         Returns:
-            Cosine distance (0.0 = identical, 1.0 = completely different)
+            Tuple of (int8 values, float32 scales) with values * scales ≈ vectors
         """
-        a = np.array(embedding1)
-        b = np.array(embedding2)
-        return 1 - (np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+        scales = np.abs(vectors).max(axis=-1 if per_vector else None, keepdims=True) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales).astype(np.int8)
+        scales = np.squeeze(scales, axis=-1) if per_vector else scales.reshape(())
+        return quantized, scales.astype(np.float32)
+
+    def _stored_distances(self, index: StoredIndex, query: np.ndarray, rows: List[int]) -> np.ndarray:
+        """
+        Cosine distances between a normalized query and rows of the stacked matrix.
+        
+        Uses the int8 copy of the matrix when QUANTIZED_MATCHING is enabled,
+        with SimSIMD's int8 dot product when it is installed.
+        """
+        if settings.QUANTIZED_MATCHING:
+            query_q, query_scale = self._quantize(query)
+            if simsimd is not None:
+                # int8 dot products on VNNI / NEON sdot, without widening the matrix first
+                raw = np.asarray(simsimd.cdist(query_q[None, :], index.quantized[rows], metric="dot", out_dtype="float32"))[0]
+            else:
+                raw = index.quantized[rows].astype(np.int32) @ query_q.astype(np.int32)
+            # Cast before scaling: int32 * float32 would widen the result to float64
+            return 1.0 - raw.astype(np.float32) * (index.scale * query_scale)
+        return self._cosine_distances(query, index.matrix[rows])
+
+    def _best_stored_match(self, index: StoredIndex, query: np.ndarray, rows: List[int]) -> Tuple[int, float]:
+        """
+        Find the closest pre-computed embedding among the given rows.
+        
+        Uses the FAISS index restricted to `rows` when faiss is installed (and
+        QUANTIZED_MATCHING is off), then the numba kernel when numba is installed, otherwise one vectorized
+        distance computation (SimSIMD or NumPy) over the gathered rows.
+        
+        Returns:
+            Tuple of (position in rows, cosine distance)
+        """
+        if index.faiss_index is not None:
+            selector = faiss.IDSelectorBatch(np.asarray(rows, dtype=np.int64))
+            scores, labels = index.faiss_index.search(
+                query[None, :], 1, params=faiss.SearchParameters(sel=selector)
+            )
+            if labels[0, 0] >= 0:
+                return rows.index(int(labels[0, 0])), 1.0 - float(scores[0, 0])
+        
+        if face_recognition_kernels.NUMBA_AVAILABLE and not settings.QUANTIZED_MATCHING:
+            best, distance = face_recognition_kernels.best_match(
+                np.asarray(index.matrix), np.asarray(rows, dtype=np.int64), query
+            )
+            return int(best), float(distance)
+        
+        distances = self._stored_distances(index, query, rows)
+        best = int(np.argmin(distances))
+        distance = float(distances[best])
+        if settings.QUANTIZED_MATCHING:
+            # Rescore the winning candidate in full precision
+            return best, self._cosine_distance_normalized(index.matrix[rows[best]], query)
+        return best, distance
+
+    @staticmethod
+    def _cosine_distance_normalized(a: np.ndarray, b: np.ndarray) -> float:
+        """Cosine distance between two already L2-normalized embeddings."""
+        return 1.0 - float(np.dot(a, b))
+
+    @staticmethod
+    def _cosine_distances(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """
+        Cosine distances between a normalized query and each row of a normalized matrix.
+        
+        Uses the numba kernel when installed, then SimSIMD, otherwise a single
+        matrix-vector product (the same order as _best_stored_match).
+        """
+        if face_recognition_kernels.NUMBA_AVAILABLE:
+            distances = np.empty(len(matrix), dtype=np.float32)
+            face_recognition_kernels.cosine_dists_to_matrix(query, np.ascontiguousarray(matrix), distances)
+            return distances
+        if simsimd is not None:
+            return np.asarray(simsimd.cdist(query[None, :], matrix, metric="cosine", out_dtype="float32"))[0]
+        return 1.0 - matrix @ query
     
-    def extract_embedding(self, image_input) -> Optional[List[float]]:
+    @staticmethod
+    def _largest_face(face_objs: List[Dict]) -> Dict:
+        """Pick the detection with the largest face box; small background false positives often come first."""
+        return max(
+            face_objs,
+            key=lambda face_obj: face_obj.get("facial_area", {}).get("w", 0) * face_obj.get("facial_area", {}).get("h", 0)
+        )
+
+    @staticmethod
+    def _face_too_small(facial_area: Dict, scale: float = 1.0) -> bool:
         """
-        Extract face embedding using multi-strategy detection.
+        Check whether a detected face box is too small to give a reliable embedding.
         
-        Tries multiple detection backends in order for maximum reliability:
-        1. OpenCV: Fast, works for most clear images
-        2. RetinaFace: More accurate, handles challenging conditions
-        3. Relaxed: Last resort for edge cases
+        The box is measured in the original photo's pixels: dividing by the
+        decode scale keeps MIN_FACE_SIZE independent of DETECTION_MAX_SIZE.
+        """
+        width = facial_area.get("w", 0) / scale
+        height = facial_area.get("h", 0) / scale
+        if min(width, height) < settings.MIN_FACE_SIZE:
+            logger.debug("Detected face is too small (%dx%d px), ignoring it", width, height)
+            return True
+        return False
+
+    def _try_strategy(
+        self,
+        image: np.ndarray,
+        target_size: Tuple[int, int],
+        detector_backend: str,
+        enforce_detection: bool,
+        scale: float = 1.0
+    ) -> Optional[np.ndarray]:
+        """
+        Run a single detection strategy.
+        
+        The largest detected face is kept; faces under MIN_FACE_SIZE (in the
+        original photo's pixels, see _face_too_small) count as no face, so they
+        never reach the recognition model.
         
-        Args:
-            image_input: Image as numpy array or file path
-            
         Returns:
-            Face embedding as list of floats, or None if no face detected
+            Preprocessed face of shape (1, H, W, 3) ready for the model, or None if this strategy found no usable face
         """
-        # Strategy 1: OpenCV (fast, primary detector)
         try:
-            embedding_objs = DeepFace.represent(
-                img_path=image_input,
-                model_name=settings.MODEL_NAME,
-                enforce_detection=True,
-                detector_backend='opencv'
+            face_objs = detection.extract_faces(
+                img_path=image,
+                target_size=target_size,
+                detector_backend=detector_backend,
+                enforce_detection=enforce_detection
             )
-            
-            if embedding_objs and len(embedding_objs) > 0:
-                logger.debug("Face detected with opencv detector")
-                return embedding_objs[0]["embedding"]
-                
+            if face_objs:
+                face_obj = self._largest_face(face_objs)
+                # A too-small face may be a false positive; let the next strategy look again
+                if self._face_too_small(face_obj.get("facial_area", {}), scale):
+                    return None
+                face = np.asarray(face_obj["face"], dtype=np.float32)
+                return face if face.ndim == 4 else face[None]
         except Exception as e:
-            logger.debug(f"OpenCV detection failed: {str(e)[:100]}")
+            mode = "strict" if enforce_detection else "relaxed"
+            logger.debug("%s (%s) detection failed: %.100s", detector_backend, mode, e)
         
-        # Strategy 2: RetinaFace (accurate, fallback for challenging images)
+        return None
+
+    @staticmethod
+    def _detection_strategies(image_input) -> Tuple[Tuple[str, bool], ...]:
+        """
+        Pick the detection strategies for an image, in order of preference.
+        
+        FORCE_DETECTOR restricts detection to one backend (strict, then relaxed).
+        Otherwise low-contrast images try RetinaFace first, skipping an opencv
+        pass that would almost certainly fail.
+        """
+        if settings.FORCE_DETECTOR:
+            return ((settings.FORCE_DETECTOR, True), (settings.FORCE_DETECTOR, False))
+        # Every 4th pixel in each direction estimates the contrast at 1/16 of the cost
+        if isinstance(image_input, np.ndarray) and image_input[::4, ::4].std() < settings.LOW_CONTRAST_STD:
+            logger.debug("Low-contrast image, trying retinaface first")
+            return LOW_CONTRAST_STRATEGIES
+        return DETECTION_STRATEGIES
+
+    def _run_strategies_parallel(
+        self,
+        image: np.ndarray,
+        target_size: Tuple[int, int],
+        strategies: Tuple[Tuple[str, bool], ...],
+        scale: float = 1.0
+    ):
+        """
+        Start every detection strategy at once and yield their results in preference order.
+        
+        Strategies that have not started yet are cancelled once the caller stops iterating.
+        """
+        futures = [
+            self._detection_pool.submit(self._try_strategy, image, target_size, backend, enforce, scale)
+            for backend, enforce in strategies
+        ]
         try:
-            embedding_objs = DeepFace.represent(
-                img_path=image_input,
-                model_name=settings.MODEL_NAME,
-                enforce_detection=True,
-                detector_backend='retinaface'
-            )
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def extract_embedding(self, image: np.ndarray, scale: float = 1.0) -> Optional[np.ndarray]:
+        """
+        Extract face embedding using multi-strategy detection.
+        
+        The face is detected and size-checked first (see _detect_face), so the
+        recognition model runs once, and only on a usable face.
+        
+        Args:
+            image: Image as numpy array
+            scale: Size of image relative to the original photo, as returned by _bytes_to_image
             
-            if embedding_objs and len(embedding_objs) > 0:
-                logger.info("Face detected with retinaface detector (fallback)")
-                return embedding_objs[0]["embedding"]
-                
-        except Exception as e:
-            logger.debug(f"RetinaFace detection failed: {str(e)[:100]}")
+        Returns:
+            L2-normalized float32 face embedding, or None if no face detected
+        """
+        self._ensure_model()
+        face = self._detect_face(image, self._model.input_shape, scale)
+        if face is None:
+            return None
+        return self._embed_faces([face])[0]
+
+    def _detect_face(
+        self, image: np.ndarray, target_size: Tuple[int, int], scale: float = 1.0
+    ) -> Optional[np.ndarray]:
+        """
+        Detect and align the face in an image, trying each detection strategy in order.
         
-        # Strategy 3: Relaxed detection (last resort)
-        try:
-            embedding_objs = DeepFace.represent(
-                img_path=image_input,
-                model_name=settings.MODEL_NAME,
-                enforce_detection=False,
-                detector_backend='opencv'
+        Tries multiple detection backends in order for maximum reliability:
+        1. OpenCV: Fast, works for most clear images
+        2. RetinaFace: More accurate, handles challenging conditions
+        3. Relaxed: Last resort for edge cases
+        
+        With PARALLEL_DETECTION enabled all strategies run concurrently, so a
+        hard image costs the slowest strategy needed instead of the sum of all
+        failed attempts. The preference order above still decides the winner.
+        
+        Low-contrast images try RetinaFace first, and FORCE_DETECTOR pins a
+        single backend (see _detection_strategies).
+        
+        Returns:
+            Preprocessed face of shape (1, H, W, 3) ready for the model, or None if no face detected
+        """
+        strategies = self._detection_strategies(image)
+        if settings.PARALLEL_DETECTION:
+            results = self._run_strategies_parallel(image, target_size, strategies, scale)
+        else:
+            results = (
+                self._try_strategy(image, target_size, backend, enforce, scale)
+                for backend, enforce in strategies
             )
-            
-            if embedding_objs and len(embedding_objs) > 0:
+        
+        for (backend, enforce), face in zip(strategies, results):
+            if face is None:
+                continue
+            if not enforce:
                 logger.warning("Face detected with relaxed detection (less reliable)")
-                return embedding_objs[0]["embedding"]
-                
-        except Exception as e:
-            logger.debug(f"Relaxed detection failed: {str(e)[:100]}")
+            elif (backend, enforce) == strategies[0]:
+                logger.debug("Face detected with %s detector", backend)
+            else:
+                logger.info("Face detected with %s detector (fallback)", backend)
+            return face
         
         logger.warning("No face detected with any detection strategy")
         return None
 
-    def save_embedding(self, student_id: str, embedding: List[float]) -> bool:
+    def _student_face(
+        self,
+        student_image: str,
+        target_size: Tuple[int, int],
+        key: Optional[bytes] = None,
+        decoded: Optional[Future] = None
+    ) -> Optional[np.ndarray]:
         """
-        Save embedding to disk for future fast recognition.
+        Detect and align the face in a student's base64 photo.
+        
+        Photos without a detectable face (or that fail to decode) are remembered
+        by digest, so later requests skip them instead of rerunning detection.
         
         Args:
-            student_id: Unique student identifier
-            embedding: Face embedding to save
+            student_image: Base64 encoded student photo
+            target_size: Model input size
+            key: Digest from _image_key, if the caller already computed it
+            decoded: Future of an already submitted decode of the photo
             
         Returns:
-            True if saved successfully, False otherwise
+            Preprocessed face of shape (1, H, W, 3) ready for the model, or None if no face detected
         """
-        file_path = os.path.join(settings.EMBEDDINGS_DIR, f"{student_id}.pkl")
+        if key is None:
+            key = self._image_key(student_image)
+        face = None
         try:
-            with open(file_path, "wb") as f:
-                pickle.dump(embedding, f)
-            self.embeddings[student_id] = embedding
-            return True
-        except Exception as e:
-            logger.error(f"Failed to save embedding for {student_id}: {e}")
-            return False
-    
-    def clear_session_cache(self, session_id: str):
+            image, scale = decoded.result() if decoded is not None else self._base64_to_image(student_image)
+            face = self._detect_face(image, target_size, scale)
+        finally:
+            # A photo that failed to decode won't decode next time either
+            if face is None:
+                with self._no_face_photos_lock:
+                    self._no_face_photos[key] = True
+        return face
+
+    def _embed_faces(self, faces: List[np.ndarray]) -> List[np.ndarray]:
         """
-        Clear cached embeddings for a specific session.
+        Run the recognition model on detected faces in batches of EMBEDDING_BATCH_SIZE.
         
         Args:
-            session_id: Session identifier to clear
+            faces: Preprocessed faces of shape (1, H, W, 3)
+            
+        Returns:
+            L2-normalized float32 embedding for each face, in input order
         """
-        if session_id in self.session_cache:
-            del self.session_cache[session_id]
-            logger.info(f"Cleared cache for session {session_id}")
-    
-    def get_or_extract_embedding(self, student_id: str, student_image: str, session_id: str) -> Optional[List[float]]:
+        results = []
+        batch_size = settings.EMBEDDING_BATCH_SIZE
+        for start in range(0, len(faces), batch_size):
+            batch = np.concatenate(faces[start:start + batch_size])
+            embeddings = self._model.model(batch, training=False).numpy().astype(np.float32, copy=False)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.where(norms > 0, norms, 1.0)
+            results.extend(embeddings)
+        return results
+
+    def _ensure_model(self):
+        """Build the recognition model if warmup() hasn't already."""
+        if self._model is None:
+            self._model = DeepFace.build_model(settings.MODEL_NAME)
+
+    def extract_embeddings_batch(
+        self, images: List[np.ndarray], scales: Optional[List[float]] = None
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Extract face embeddings for several images with batched model forward passes.
+        
+        Faces are detected per image with the same strategy order as
+        extract_embedding; only the recognition model runs batched.
+        
+        Args:
+            images: Images as numpy arrays
+            scales: Size of each image relative to its original photo, as returned by _bytes_to_image (default 1.0)
+            
+        Returns:
+            L2-normalized float32 face embedding (or None if no face detected) for each image, in input order
+        """
+        self._ensure_model()
+        target_size = self._model.input_shape
+        if scales is None:
+            scales = [1.0] * len(images)
+        
+        faces = []
+        indices = []
+        for index, (image, scale) in enumerate(zip(images, scales)):
+            face = self._detect_face(image, target_size, scale)
+            if face is not None:
+                faces.append(face)
+                indices.append(index)
+        
+        results: List[Optional[np.ndarray]] = [None] * len(images)
+        for index, embedding in zip(indices, self._embed_faces(faces)):
+            results[index] = embedding
+        return results
+
+    def _pending_photos(
+        self, students: List[Dict], session_bucket: Dict[str, np.ndarray]
+    ) -> Tuple[List[Dict], List[bytes]]:
+        """
+        Find students whose embedding must be extracted from their photo.
+        
+        Photos already embedded for an earlier session (of this class or another one
+        sharing the student) are copied into the session cache without running the
+        model, and photos already known to have no detectable face are skipped.
+        
+        Args:
+            students: List of student dicts with 'id', 'nom', 'image' fields
+            session_bucket: Session cache entry to fill
+            
+        Returns:
+            Tuple of (students still needing extraction, digest of each one's photo)
+        """
+        missing = [
+            student for student in students
+            if student.get('image') and student.get('id') not in self.embeddings
+            and student.get('id') not in session_bucket
+        ]
+        pending = []
+        keys = []
+        reused = 0
+        with self._photo_embeddings_lock, self._no_face_photos_lock:
+            for student in missing:
+                key = self._image_key(student['image'])
+                embedding = self._photo_embeddings.get(key)
+                if embedding is not None:
+                    session_bucket[student['id']] = embedding
+                    reused += 1
+                elif key not in self._no_face_photos:
+                    pending.append(student)
+                    keys.append(key)
+        if reused:
+            logger.info(f"Reused {reused} embeddings from earlier sessions")
+        return pending, keys
+
+    def _extract_pending_embeddings(
+        self, pending: List[Dict], keys: List[bytes], session_bucket: Dict[str, np.ndarray]
+    ) -> int:
         """
-        Get embedding from cache or extract and cache it.
+        Batch-extract embeddings for the students returned by _pending_photos into the session cache.
         
-        Checks in order:
-        1. Pre-computed embeddings on disk
-        2. Session cache
-        3. Extract new embedding and cache it
+        Photos are decoded on a background pool while faces are detected in
+        order, so decoding overlaps detection instead of adding to it.
         
         Args:
-            student_id: Unique student identifier
-            student_image: Base64 encoded student image
-            session_id: Current session identifier
+            pending: Students needing extraction
+            keys: Digest of each student's photo
+            session_bucket: Session cache entry to fill
             
         Returns:
-            Face embedding or None if extraction fails
+            Number of embeddings newly extracted
         """
-        # Check pre-computed embeddings
-        if student_id in self.embeddings:
-            logger.debug(f"Using pre-computed embedding for {student_id}")
-            return self.embeddings[student_id]
+        if not pending:
+            return 0
+        
+        logger.info(f"Extracting embeddings for {len(pending)} uncached students...")
+        self._ensure_model()
+        target_size = self._model.input_shape
         
-        # Check session cache
-        if session_id in self.session_cache and student_id in self.session_cache[session_id]:
-            logger.debug(f"Using cached embedding for {student_id} from session {session_id}")
-            return self.session_cache[session_id][student_id]
+        decodes = [
+            self._decode_pool.submit(self._base64_to_image, student['image'])
+            for student, key in zip(pending, keys)
+        ]
         
-        # Extract new embedding
-        student_image_array = self._base64_to_image(student_image)
-        embedding = self.extract_embedding(student_image_array)
+        student_ids = []
+        face_keys = []
+        faces = []
+        for student, key, decoded in zip(pending, keys, decodes):
+            try:
+                face = self._student_face(student['image'], target_size, key, decoded)
+            except Exception as e:
+                logger.error(f"Error decoding image for student {student.get('nom', 'Unknown')}: {e}")
+                continue
+            if face is not None:
+                student_ids.append(student['id'])
+                face_keys.append(key)
+                faces.append(face)
         
-        if embedding:
-            # Cache in session
-            if session_id not in self.session_cache:
-                self.session_cache[session_id] = {}
-            self.session_cache[session_id][student_id] = embedding
-            logger.debug(f"Extracted and cached new embedding for {student_id}")
+        embeddings = self._embed_faces(faces)
+        with self._photo_embeddings_lock:
+            for student_id, key, embedding in zip(student_ids, face_keys, embeddings):
+                embedding = embedding.copy()  # Own its memory rather than pin the whole batch output
+                embedding.setflags(write=False)
+                session_bucket[student_id] = embedding
+                self._photo_embeddings[key] = embedding
         
-        return embedding
+        return len(student_ids)
 
+    def save_embeddings(self, student_ids: List[str], embeddings: List[np.ndarray]) -> bool:
+        """
+        Save several already normalized embeddings with a single store write.
+        
+        Args:
+            student_ids: Unique student identifiers
+            embeddings: L2-normalized face embeddings, as returned by extract_embeddings_batch
+            
+        Returns:
+            True if saved successfully, False otherwise
+        """
+        if not student_ids:
+            return True
+        try:
+            self.embeddings.add_many(student_ids, np.stack(embeddings))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save {len(student_ids)} embeddings: {e}")
+            return False
+    
+    def clear_session_cache(self, session_id: str):
+        """
+        Clear cached embeddings for a specific session.
+        
+        Args:
+            session_id: Session identifier to clear
+        """
+        with self._session_locks_guard:
+            self._session_locks.pop(session_id, None)
+        with self._session_cache_lock:
+            removed = self.session_cache.pop(session_id, None)
+        if removed is not None:
+            logger.info(f"Cleared cache for session {session_id}")
+
+    def _get_session_bucket(self, session_id: str) -> Dict[str, np.ndarray]:
+        """Return the embedding cache of a session, creating it if needed."""
+        with self._session_cache_lock:
+            session_bucket = self.session_cache.get(session_id)
+            if session_bucket is None:
+                session_bucket = self.session_cache[session_id] = {}
+                logger.info(f"Initialized cache for session {session_id}")
+            return session_bucket
 
-    def recognize_face_from_students(self, uploaded_base64_image: str, students: List[Dict], session_id: str) -> Tuple[Optional[str], Optional[str], float]:
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        """Return the lock guarding embedding extraction for a session."""
+        with self._session_locks_guard:
+            lock = self._session_locks.get(session_id)
+            if lock is None:
+                lock = self._session_locks[session_id] = threading.Lock()
+            return lock
+    
+    def recognize_face_from_bytes(self, uploaded_image_data: bytes, students: List[Dict], session_id: str) -> Tuple[Optional[str], Optional[str], float]:
         """
         Recognize face from uploaded image against student list.
         
@@ -237,7 +884,7 @@ class FaceRecognizer:
         for every attendance mark within the same session.
         
         Args:
-            uploaded_base64_image: Base64 encoded image from mobile app
+            uploaded_image_data: Uploaded image file contents (already base64-decoded)
             students: List of student dicts with 'id', 'nom', 'image' fields
             session_id: Session ID for caching embeddings
             
@@ -245,69 +892,87 @@ class FaceRecognizer:
             Tuple of (student_id, student_name, confidence)
             Returns (None, None, confidence) if no match found
         """
-        # Extract embedding from uploaded image
-        logger.info("Extracting embedding from uploaded image...")
-        uploaded_image = self._base64_to_image(uploaded_base64_image)
-        uploaded_embedding = self.extract_embedding(uploaded_image)
+        self.reload_embeddings_if_changed()
         
+        # Extract embeddings for all students missing from both caches in one batch.
+        # Concurrent requests for the same session wait here and then find the embeddings cached.
+        session_bucket = self._get_session_bucket(session_id)
+        uploaded_future = None
+        with self._session_lock(session_id):
+            pending, keys = self._pending_photos(students, session_bucket)
+            if pending:
+                # The two extractions are independent: embed the upload in the background meanwhile.
+                # If it has no face, the students' embeddings stay cached for the session's next request.
+                uploaded_future = self._upload_pool.submit(
+                    lambda: self.extract_embedding(*self._bytes_to_image(uploaded_image_data))
+                )
+            extracted_count = self._extract_pending_embeddings(pending, keys, session_bucket)
+        
+        logger.debug("Extracting embedding from uploaded image...")
+        if uploaded_future is not None:
+            uploaded_embedding = uploaded_future.result()
+        else:
+            uploaded_embedding = self.extract_embedding(*self._bytes_to_image(uploaded_image_data))
         if uploaded_embedding is None:
             logger.warning("No face detected in uploaded image")
             return None, None, 0.0
         
-        logger.info("Successfully extracted embedding from uploaded image")
+        logger.debug("Successfully extracted embedding from uploaded image")
         
-        # Initialize cache for this session if needed
-        if session_id not in self.session_cache:
-            self.session_cache[session_id] = {}
-            logger.info(f"Initialized cache for session {session_id}")
-        
-        # Compare with students
-        best_match_id = None
-        best_match_name = None
-        min_distance = 1.0
-        cached_count = 0
-        extracted_count = 0
+        # Collect candidate embeddings; pre-computed ones are referenced by row of the stored matrix
+        index = self._get_stored_index()
+        stored_rows: List[int] = []
+        stored_students: List[Dict] = []
+        session_vectors: List[np.ndarray] = []
+        session_students: List[Dict] = []
         
-        logger.info(f"Comparing with {len(students)} students...")
+        logger.debug("Comparing with %d students...", len(students))
         
-        for i, student in enumerate(students, 1):
-            student_id = student.get('id')
-            student_name = student.get('nom', 'Unknown')
-            student_image = student.get('image')
+        # Per-student logging uses %-style arguments so nothing is formatted unless the record is emitted
+        id_to_row = index.id_to_row
+        for student in students:
+            if not student.get('image'):
+                continue
             
-            if not student_image:
+            student_id = student.get('id')
+            row = id_to_row.get(student_id)
+            if row is not None:
+                stored_rows.append(row)
+                stored_students.append(student)
                 continue
             
-            try:
-                # Get or extract embedding with caching
-                student_embedding = self.get_or_extract_embedding(student_id, student_image, session_id)
-                
-                if student_embedding is None:
-                    logger.warning(f"Could not get embedding for {student_name}")
-                    continue
-                
-                # Track cache usage
-                if student_id in self.embeddings or (session_id in self.session_cache and student_id in self.session_cache[session_id]):
-                    cached_count += 1
-                else:
-                    extracted_count += 1
-                
-                # Calculate distance
-                distance = self.compute_cosine_distance(uploaded_embedding, student_embedding)
-                
-                # Track best match
-                if distance < min_distance:
-                    min_distance = distance
-                    best_match_id = student_id
-                    best_match_name = student_name
-                    logger.info(f"[{i}/{len(students)}] New best match: {student_name} (distance: {distance:.4f})")
-                    
-            except Exception as e:
-                logger.error(f"Error processing student {student_name}: {e}")
+            student_embedding = session_bucket.get(student_id)
+            if student_embedding is None:
+                logger.warning("Could not get embedding for %s", student.get('nom', 'Unknown'))
                 continue
+            
+            session_vectors.append(student_embedding)
+            session_students.append(student)
         
+        cached_count = len(stored_students) + len(session_students) - extracted_count
         logger.info(f"Recognition complete: {cached_count} cached, {extracted_count} newly extracted")
         
+        candidates = stored_students + session_students
+        if not candidates:
+            logger.info("✗ No match found. No student embeddings available")
+            return None, None, 0.0
+        
+        # Score every candidate with one vectorized search per source
+        query = uploaded_embedding
+        best = -1
+        min_distance = 1.0
+        if stored_rows:
+            best, min_distance = self._best_stored_match(index, query, stored_rows)
+        # A near-identical pre-computed match can't be beaten meaningfully; skip the session scan
+        if session_vectors and not (best >= 0 and min_distance < settings.EARLY_EXIT_THRESHOLD):
+            session_distances = self._cosine_distances(query, np.stack(session_vectors))
+            session_best = int(np.argmin(session_distances))
+            if best < 0 or session_distances[session_best] < min_distance:
+                best = len(stored_rows) + session_best
+                min_distance = float(session_distances[session_best])
+        best_match_id = candidates[best].get('id')
+        best_match_name = candidates[best].get('nom', 'Unknown')
+        
         # Check if best match exceeds threshold
         confidence = 1 - min_distance
         
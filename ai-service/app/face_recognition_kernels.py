@@ -0,0 +1,79 @@
+"""
+Face Recognition Kernels
+
+Numba-compiled float32 scoring kernels. Float32 scoring prefers FAISS (stored
+embeddings only), then these kernels, then SimSIMD, then NumPy. Importing this
+module never fails: NUMBA_AVAILABLE is False when numba is missing and callers
+fall back to the next option.
+
+The kernels are serial: they are called from concurrent request threads, and
+numba's default workqueue threading layer aborts the process when two threads
+enter parallel kernels at once. A class has too few rows for prange to pay off
+anyway.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(fastmath=True, cache=True)
+    def best_match(matrix, rows, query):
+        """
+        Find the row closest to a query among selected rows of a matrix.
+
+        Rows are read in place, so no (len(rows), D) copy is gathered first.
+
+        Args:
+            matrix: (N, D) float32 matrix of L2-normalized embeddings
+            rows: int64 array of row indices to consider (non-empty)
+            query: (D,) float32 L2-normalized query embedding
+
+        Returns:
+            Tuple of (position in rows, cosine distance)
+        """
+        distances = np.empty(rows.shape[0], dtype=np.float32)
+        for i in range(rows.shape[0]):
+            row = rows[i]
+            dot = np.float32(0.0)
+            for k in range(matrix.shape[1]):
+                dot += matrix[row, k] * query[k]
+            distances[i] = 1.0 - dot
+
+        best = 0
+        for i in range(1, distances.shape[0]):
+            if distances[i] < distances[best]:
+                best = i
+        return best, distances[best]
+
+    @njit(fastmath=True, cache=True, boundscheck=False)
+    def cosine_dists_to_matrix(query, matrix, out):
+        """
+        Cosine distance between a query and every row of a matrix.
+
+        Args:
+            query: (D,) float32 L2-normalized query embedding
+            matrix: (N, D) float32 matrix of L2-normalized embeddings
+            out: (N,) float32 array receiving the distances
+        """
+        for i in range(matrix.shape[0]):
+            dot = np.float32(0.0)
+            for k in range(matrix.shape[1]):
+                dot += matrix[i, k] * query[k]
+            out[i] = 1.0 - dot
+
+
+def warmup(dim: int):
+    """Compile the kernels for float32 input so the first request doesn't pay for it."""
+    if NUMBA_AVAILABLE:
+        matrix = np.zeros((1, dim), dtype=np.float32)
+        matrix.setflags(write=False)  # Same signature as the read-only embedding memmap
+        best_match(matrix, np.zeros(1, dtype=np.int64), np.zeros(dim, dtype=np.float32))
+        cosine_dists_to_matrix(
+            np.zeros(dim, dtype=np.float32), np.zeros((1, dim), dtype=np.float32), np.empty(1, dtype=np.float32)
+        )
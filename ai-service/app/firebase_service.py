@@ -1,6 +1,10 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import NotFound
 from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+import threading
 import logging
 from app.config import settings
 
@@ -10,6 +14,13 @@ class FirebaseService:
     def __init__(self):
         """Initialize Firebase Admin SDK."""
         self.db = None
+        # Students per class; class rosters change rarely, so a short TTL saves two queries per mark
+        self._students_cache: TTLCache = TTLCache(
+            maxsize=settings.STUDENTS_CACHE_MAX_CLASSES,
+            ttl=settings.STUDENTS_CACHE_TTL_SECONDS
+        )
+        self._students_cache_lock = threading.Lock()  # TTLCache is not thread-safe
+        self._query_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="firestore-query")
         self.initialize_firebase()
     
     def initialize_firebase(self):
@@ -35,30 +46,35 @@ class FirebaseService:
         """
         Fetch all students from a specific class.
         Handles both 'classe' and 'Classe' field names.
+        
+        Results are cached per class for STUDENTS_CACHE_TTL_SECONDS.
         """
+        with self._students_cache_lock:
+            cached = self._students_cache.get(classe)
+        if cached is not None:
+            logger.debug(f"Using cached student list for class '{classe}'")
+            return cached
+        
         try:
-            students = []
-            
-            # Query with 'Classe' (capital C)
             students_ref = self.db.collection('Etudiant')
-            query1 = students_ref.where('Classe', '==', classe).stream()
-            
-            for doc in query1:
-                student_data = doc.to_dict()
-                student_data['id'] = doc.id
-                students.append(student_data)
             
-            # Query with 'classe' (lowercase c) - avoid duplicates
-            query2 = students_ref.where('classe', '==', classe).stream()
-            existing_ids = {s['id'] for s in students}
+            def query(field: str):
+                return list(students_ref.where(field, '==', classe).stream())
             
-            for doc in query2:
-                if doc.id not in existing_ids:
-                    student_data = doc.to_dict()
-                    student_data['id'] = doc.id
-                    students.append(student_data)
+            # Query 'Classe' (capital C) and 'classe' (lowercase c) concurrently;
+            # keying by document id drops students that carry both fields
+            students_by_id = {}
+            for docs in self._query_pool.map(query, ('Classe', 'classe')):
+                for doc in docs:
+                    if doc.id not in students_by_id:
+                        student_data = doc.to_dict()
+                        student_data['id'] = doc.id
+                        students_by_id[doc.id] = student_data
             
+            students = list(students_by_id.values())
             logger.info(f"Found {len(students)} students in class '{classe}'")
+            with self._students_cache_lock:
+                self._students_cache[classe] = students
             return students
             
         except Exception as e:
@@ -81,7 +97,10 @@ class FirebaseService:
     def mark_student_present(self, session_id: str, student_id: str) -> bool:
         """
         Mark a student as present for a session.
-        Updates or creates a Presence record.
+        Updates or creates a Presence record with one lookup query and at
+        most one write; nothing is written if the record is already present.
+        Session and student documents are not read first: their references
+        are only stored, and a record deleted after the lookup is recreated.
         """
         try:
             # Get references
@@ -100,13 +119,21 @@ class FirebaseService:
                 existing_record = doc
                 break
             
-            if existing_record:
-                # Update existing record
-                existing_record.reference.update({
-                    'status': 'present'
-                })
-                logger.info(f"Updated attendance for student {student_id} in session {session_id}")
-            else:
+            if existing_record and (existing_record.to_dict() or {}).get('status') == 'present':
+                # Already marked (e.g. the student was scanned twice), skip the write round-trip
+                logger.info(f"Student {student_id} already marked present in session {session_id}")
+            elif existing_record:
+                # Update existing record without re-reading it; update() fails if it was deleted meanwhile
+                try:
+                    existing_record.reference.update({
+                        'status': 'present'
+                    })
+                    logger.info(f"Updated attendance for student {student_id} in session {session_id}")
+                except NotFound:
+                    logger.warning(f"Attendance record for student {student_id} was deleted, recreating it")
+                    existing_record = None
+            
+            if existing_record is None:
                 # Create new record
                 presence_ref.add({
                     'Seance_id': session_ref,
@@ -4,18 +4,25 @@ from app.models import (
     MarkAttendanceRequest,
     AttendanceResult
 )
-from app.face_recognition import FaceRecognizer
+from app.face_recognition import FaceRecognizer, decode_base64_image
 from app.firebase_service import FirebaseService
 from app.config import settings
+import asyncio
+import itertools
 import logging
 import os
 import json
-import base64
-from datetime import datetime
+import time
 from typing import Optional
 
+# Optional accelerator: C JSON serialization, with a stdlib fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=settings.LOG_LEVEL)
 logger = logging.getLogger("ai_service")
 
 app = FastAPI(
@@ -34,11 +41,56 @@ app.add_middleware(
 
 # Initialize global instances
 recognizer = FaceRecognizer()
+_request_counter = itertools.count()  # Keeps temp filenames unique within the same nanosecond
 firebase_service: Optional[FirebaseService] = None
 
+def _write_json(path: str, data, indent: bool = False):
+    """Write an audit JSON file, with orjson when installed."""
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0))
+    else:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2 if indent else None, separators=None if indent else (",", ":"))
+
+def _write_bytes(path: str, data: bytes):
+    """Write a binary audit file."""
+    with open(path, "wb") as f:
+        f.write(data)
+
+async def _persist_audit(session_dict: dict, raw_image: bytes, temp_filename: str):
+    """Save the uploaded image and session metadata, as enabled by the audit settings."""
+    writes = []
+    if settings.AUDIT_SAVE_IMAGES:
+        image_path = os.path.join(settings.TEMP_IMAGES_DIR, f"{temp_filename}_uploaded.jpg")
+        writes.append(asyncio.to_thread(_write_bytes, image_path, raw_image))
+    if settings.AUDIT_TRAIL_ENABLED:
+        metadata_path = os.path.join(settings.TEMP_IMAGES_DIR, f"{temp_filename}_session.json")
+        writes.append(asyncio.to_thread(_write_json, metadata_path, session_dict, True))
+    if writes:
+        # Run off the event loop, concurrently
+        await asyncio.gather(*writes)
+        logger.debug("Saved audit files: %s_*", temp_filename)
+
+async def _persist_students(students: list, temp_filename: str):
+    """Save the class's student list (without images) when the audit trail is enabled."""
+    if not settings.AUDIT_TRAIL_ENABLED:
+        return
+    # Save without image data (too large for JSON); compact, as it can hold hundreds of students
+    students_summary = [{
+        'id': s.get('id'),
+        'nom': s.get('nom'),
+        'cin': s.get('CIN') or s.get('cin'),
+        'classe': s.get('classe') or s.get('Classe'),
+        'has_image': bool(s.get('image'))
+    } for s in students]
+    students_list_path = os.path.join(settings.TEMP_IMAGES_DIR, f"{temp_filename}_students.json")
+    await asyncio.to_thread(_write_json, students_list_path, students_summary)
+    logger.debug("Saved student list: %s", students_list_path)
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize Firebase on startup."""
+    """Initialize Firebase and load face recognition models on startup."""
     global firebase_service
     try:
         firebase_service = FirebaseService()
@@ -46,6 +98,12 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to initialize Firebase service: {e}")
         logger.warning("Attendance marking will not be available")
+    
+    try:
+        recognizer.warmup()
+    except Exception as e:
+        logger.error(f"Failed to warm up face recognizer: {e}")
+        logger.warning("Models will be loaded on the first attendance request")
 
 @app.get("/", tags=["Health"])
 async def health_check():
@@ -71,27 +129,13 @@ async def mark_attendance(request: MarkAttendanceRequest):
     logger.info(f"Processing attendance for session: {request.session.id}, class: {request.session.classe}")
     
     # Step 1: Save uploaded image and session info temporarily
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
-    temp_filename = f"temp_{request.session.id}_{timestamp}"
+    temp_filename = f"temp_{request.session.id}_{time.time_ns()}_{next(_request_counter)}"
     
-    # Save uploaded image
-    uploaded_image_path = os.path.join(settings.TEMP_IMAGES_DIR, f"{temp_filename}_uploaded.jpg")
     try:
-        # Decode and save base64 image
-        if "," in request.image:
-            image_data = request.image.split(",")[1]
-        else:
-            image_data = request.image
-        
-        with open(uploaded_image_path, "wb") as f:
-            f.write(base64.b64decode(image_data))
-        logger.info(f"Saved uploaded image: {uploaded_image_path}")
-        
-        # Save session metadata
-        metadata_path = os.path.join(settings.TEMP_IMAGES_DIR, f"{temp_filename}_session.json")
-        with open(metadata_path, "w") as f:
-            json.dump(request.session.dict(), f, indent=2)
-        logger.info(f"Saved session metadata: {metadata_path}")
+        # Decode the base64 image once; the same bytes are saved and recognized
+        image_bytes = decode_base64_image(request.image)
+        session_dict = request.session.model_dump(mode="json") if settings.AUDIT_TRAIL_ENABLED else None
+        await _persist_audit(session_dict, image_bytes, temp_filename)
         
     except Exception as e:
         logger.error(f"Error saving temporary files: {e}")
@@ -102,8 +146,9 @@ async def mark_attendance(request: MarkAttendanceRequest):
     
     try:
         # Step 2: Fetch all students in the class from Firebase
-        logger.info(f"Fetching students for class: {request.session.classe}")
-        students = firebase_service.get_students_by_class(request.session.classe)
+        # Firestore calls are blocking RPCs, so they run in worker threads like recognition does
+        logger.debug("Fetching students for class: %s", request.session.classe)
+        students = await asyncio.to_thread(firebase_service.get_students_by_class, request.session.classe)
         
         if not students:
             return AttendanceResult(
@@ -114,24 +159,15 @@ async def mark_attendance(request: MarkAttendanceRequest):
         
         logger.info(f"Found {len(students)} students in class {request.session.classe}")
         
-        # Step 3: Save student list locally
-        students_list_path = os.path.join(settings.TEMP_IMAGES_DIR, f"{temp_filename}_students.json")
-        with open(students_list_path, "w") as f:
-            # Save without image data (too large for JSON)
-            students_summary = [{
-                'id': s.get('id'),
-                'nom': s.get('nom'),
-                'cin': s.get('CIN') or s.get('cin'),
-                'classe': s.get('classe') or s.get('Classe'),
-                'has_image': bool(s.get('image'))
-            } for s in students]
-            json.dump(students_summary, f, indent=2)
-        logger.info(f"Saved student list: {students_list_path}")
+        # Step 3: Save student list locally (audit trail only)
+        await _persist_students(students, temp_filename)
         
         # Step 4: Recognize face with caching (reuses embeddings within same session)
-        logger.info("Starting face recognition process with caching...")
-        recognized_id, recognized_name, confidence = recognizer.recognize_face_from_students(
-            request.image,
+        # Runs in a worker thread so image decoding and inference don't block the event loop
+        logger.debug("Starting face recognition process with caching...")
+        recognized_id, recognized_name, confidence = await asyncio.to_thread(
+            recognizer.recognize_face_from_bytes,
+            image_bytes,
             students,
             request.session.id  # Pass session ID for caching
         )
@@ -146,8 +182,8 @@ async def mark_attendance(request: MarkAttendanceRequest):
         logger.info(f"Face recognized: {recognized_name} ({recognized_id}) with confidence {confidence:.2f}")
         
         # Step 5: Mark student as present in Firebase
-        logger.info(f"Marking {recognized_name} as present in session {request.session.id}")
-        success = firebase_service.mark_student_present(request.session.id, recognized_id)
+        logger.debug("Marking %s as present in session %s", recognized_name, request.session.id)
+        success = await asyncio.to_thread(firebase_service.mark_student_present, request.session.id, recognized_id)
         
         if success:
             logger.info(f"Successfully marked {recognized_name} ({recognized_id}) as present")
@@ -175,18 +211,3 @@ async def mark_attendance(request: MarkAttendanceRequest):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing attendance: {str(e)}"
         )
-    
-    finally:
-        # Cleanup: Delete temporary files after processing (optional - keep for debugging)
-        try:
-            # Keep files for audit trail - uncomment to delete
-            # if os.path.exists(uploaded_image_path):
-            #     os.remove(uploaded_image_path)
-            # if os.path.exists(metadata_path):
-            #     os.remove(metadata_path)
-            # if os.path.exists(students_list_path):
-            #     os.remove(students_list_path)
-            # logger.info("Cleaned up temporary files")
-            pass
-        except Exception as e:
-            logger.warning(f"Failed to cleanup temporary files: {e}")
@@ -2,15 +2,19 @@
 Pre-compute and store student face embeddings for faster recognition.
 
 This script extracts embeddings from all students' images in Firebase
-and saves them to the embeddings/ folder. Once pre-computed, the AI
+and saves them to the embedding store in the embeddings/ folder
+(embeddings.bin + embedding_ids.json). Once pre-computed, the AI
 service can use these embeddings for instant face recognition without
 needing to extract embeddings on every attendance mark.
 
 Usage:
-    python precompute_embeddings.py [--class CLASSE]
+    python precompute_embeddings.py [--class CLASSE] [--student ID ...] [--force]
 
 Options:
     --class CLASSE    Only process students from a specific class
+    --student ID      Only process this student, re-computing their embedding
+                      (repeatable; use after a student's photo changes)
+    --force           Re-compute embeddings that already exist
     
 Performance:
     - Initial extraction: ~1-2 seconds per student
@@ -21,11 +25,16 @@ import sys
 import os
 import argparse
 import firebase_admin
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 from firebase_admin import credentials, firestore
-from app.face_recognition import FaceRecognizer
 from app.config import settings
 import logging
 
+if TYPE_CHECKING:
+    # Imported lazily at runtime: it pulls in DeepFace and TensorFlow, which --help never needs
+    from app.face_recognition import FaceRecognizer
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -53,42 +62,84 @@ def initialize_firebase():
     
     return firestore.client()
 
-def fetch_students(db, classe: str = None):
-    """Fetch students from Firebase."""
+def fetch_students(db, classe: str = None, fields=('nom', 'image')):
+    """
+    Fetch students from Firebase.
+    
+    Only `fields` are transferred (plus the document id), so unrelated
+    student data never crosses the network.
+    """
     students_ref = db.collection('Etudiant')
+    fields = list(fields)
     
     if classe:
         logger.info(f"Fetching students from class: {classe}")
         # Try both 'Classe' and 'classe' fields
-        query1 = students_ref.where('Classe', '==', classe).stream()
-        query2 = students_ref.where('classe', '==', classe).stream()
-        
-        students = []
-        ids_seen = set()
-        
-        for doc in query1:
-            data = doc.to_dict()
-            data['id'] = doc.id
-            students.append(data)
-            ids_seen.add(doc.id)
-        
-        for doc in query2:
-            if doc.id not in ids_seen:
-                data = doc.to_dict()
-                data['id'] = doc.id
-                students.append(data)
+        queries = [
+            students_ref.where(field, '==', classe).select(fields)
+            for field in ('Classe', 'classe')
+        ]
     else:
         logger.info("Fetching all students")
-        students = []
-        for doc in students_ref.stream():
-            data = doc.to_dict()
+        queries = [students_ref.select(fields)]
+    
+    students = {}
+    for query in queries:
+        for doc in query.stream():
+            if doc.id not in students:
+                data = doc.to_dict()
+                data['id'] = doc.id
+                students[doc.id] = data
+    
+    return list(students.values())
+
+def fetch_students_by_id(db, student_ids, fields=('nom', 'image')):
+    """Fetch specific students with batched document reads, transferring only `fields`."""
+    students_ref = db.collection('Etudiant')
+    refs = [students_ref.document(student_id) for student_id in student_ids]
+    students = []
+    for doc in db.get_all(refs, field_paths=list(fields)):
+        if doc.exists:
+            data = doc.to_dict() or {}
             data['id'] = doc.id
             students.append(data)
-    
+        else:
+            logger.warning(f"Student {doc.id} not found")
     return students
 
-def precompute_embeddings(classe: str = None):
-    """Main function to pre-compute embeddings."""
+def fetch_student_images(db, student_ids):
+    """
+    Fetch the photos of specific students with batched document reads.
+    
+    Returns:
+        Dict of student id -> base64 image (students without an image are omitted)
+    """
+    students_ref = db.collection('Etudiant')
+    refs = [students_ref.document(student_id) for student_id in student_ids]
+    images = {}
+    for doc in db.get_all(refs, field_paths=['image']):
+        if doc.exists:
+            image = (doc.to_dict() or {}).get('image')
+            if image:
+                images[doc.id] = image
+    return images
+
+def decode_student_image(recognizer: "FaceRecognizer", student: dict):
+    """Decode a student's photo, returning ((image, scale), None) or (None, error)."""
+    try:
+        return recognizer._base64_to_image(student['image']), None
+    except Exception as e:
+        return None, e
+
+def precompute_embeddings(classe: str = None, student_ids=None, force: bool = False):
+    """
+    Main function to pre-compute embeddings.
+    
+    Students that already have an embedding are skipped unless `force` is set
+    or they are listed in `student_ids`.
+    """
+    from app.face_recognition import FaceRecognizer
+    
     logger.info("=" * 60)
     logger.info("Student Face Embeddings Pre-computation")
     logger.info("=" * 60)
@@ -97,60 +148,99 @@ def precompute_embeddings(classe: str = None):
     db = initialize_firebase()
     recognizer = FaceRecognizer()
     
-    # Fetch students
-    students = fetch_students(db, classe)
+    # Fetch students without their photos; only students missing an embedding need one
+    fields = ('nom', 'Classe', 'classe')
+    if student_ids:
+        students = fetch_students_by_id(db, student_ids, fields=fields)
+        force = True
+    else:
+        students = fetch_students(db, classe, fields=fields)
     logger.info(f"Found {len(students)} students to process\n")
     
     if not students:
         logger.warning("No students found!")
         return
     
-    # Process each student
     success_count = 0
     skip_count = 0
     fail_count = 0
     
-    for i, student in enumerate(students, 1):
-        student_id = student.get('id')
-        student_name = student.get('nom', 'Unknown')
-        student_image = student.get('image')
-        
-        logger.info(f"[{i}/{len(students)}] Processing: {student_name} ({student_id})")
-        
-        # Check if already exists
-        embedding_path = os.path.join(settings.EMBEDDINGS_DIR, f"{student_id}.pkl")
-        if os.path.exists(embedding_path):
-            logger.info(f"  ⊙ Embedding already exists, skipping")
+    # Skip students that already have an embedding, then download photos for the rest only
+    missing = []
+    for student in students:
+        if not force and student.get('id') in recognizer.embeddings:
+            logger.info(f"⊙ {student.get('nom', 'Unknown')}: embedding already exists, skipping")
             skip_count += 1
-            continue
-        
-        # Check if student has image
-        if not student_image:
-            logger.warning(f"  ✗ No image available")
+        else:
+            missing.append(student)
+    
+    # Append each class's rows next to each other, so recognizing a class touches
+    # contiguous pages of the memory-mapped matrix
+    missing.sort(key=lambda student: str(student.get('Classe') or student.get('classe') or ''))
+    
+    images = fetch_student_images(db, [student['id'] for student in missing]) if missing else {}
+    todo = []
+    for student in missing:
+        student['image'] = images.get(student['id'])
+        if not student['image']:
+            logger.warning(f"✗ {student.get('nom', 'Unknown')}: no image available")
             fail_count += 1
-            continue
+        else:
+            todo.append(student)
+    
+    # Decode photos on a thread pool, one chunk ahead of the chunk being extracted;
+    # each chunk then goes through one batched forward pass and one store write
+    chunk_size = settings.EMBEDDING_BATCH_SIZE
+    chunks = [todo[start:start + chunk_size] for start in range(0, len(todo), chunk_size)]
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        def submit(chunk):
+            return [pool.submit(decode_student_image, recognizer, student) for student in chunk]
         
-        try:
-            # Extract embedding
-            student_image_array = recognizer._base64_to_image(student_image)
-            embedding = recognizer.extract_embedding(student_image_array)
+        pending = submit(chunks[0]) if chunks else []
+        for index, chunk in enumerate(chunks):
+            decodes = pending
+            if index + 1 < len(chunks):
+                pending = submit(chunks[index + 1])
             
-            if embedding is None:
-                logger.warning(f"  ✗ Failed to extract embedding (no face detected)")
-                fail_count += 1
+            logger.info(f"[{index * chunk_size + 1}-{index * chunk_size + len(chunk)}/{len(todo)}] Processing {len(chunk)} students")
+            
+            decoded_students = []
+            images = []
+            scales = []
+            for student, decode in zip(chunk, decodes):
+                decoded, error = decode.result()
+                if error is not None:
+                    logger.error(f"  ✗ {student.get('nom', 'Unknown')}: error decoding image: {error}")
+                    fail_count += 1
+                    continue
+                decoded_students.append(student)
+                image, scale = decoded
+                images.append(image)
+                scales.append(scale)
+            
+            try:
+                embeddings = recognizer.extract_embeddings_batch(images, scales)
+            except Exception as e:
+                logger.error(f"  ✗ Error extracting embeddings: {e}")
+                fail_count += len(decoded_students)
                 continue
             
-            # Save embedding
-            if recognizer.save_embedding(student_id, embedding):
-                logger.info(f"  ✓ Embedding saved successfully")
-                success_count += 1
+            student_ids = []
+            found = []
+            for student, embedding in zip(decoded_students, embeddings):
+                if embedding is None:
+                    logger.warning(f"  ✗ {student.get('nom', 'Unknown')}: failed to extract embedding (no face detected)")
+                    fail_count += 1
+                else:
+                    student_ids.append(student['id'])
+                    found.append(embedding)
+            
+            if recognizer.save_embeddings(student_ids, found):
+                logger.info(f"  ✓ {len(student_ids)} embeddings saved successfully")
+                success_count += len(student_ids)
             else:
-                logger.error(f"  ✗ Failed to save embedding")
-                fail_count += 1
-                
-        except Exception as e:
-            logger.error(f"  ✗ Error: {e}")
-            fail_count += 1
+                logger.error(f"  ✗ Failed to save {len(student_ids)} embeddings")
+                fail_count += len(student_ids)
     
     # Summary
     logger.info("\n" + "=" * 60)
@@ -163,8 +253,7 @@ def precompute_embeddings(classe: str = None):
     logger.info("=" * 60)
     
     if success_count > 0:
-        logger.info("\n💡 Tip: Restart the AI service to load new embeddings:")
-        logger.info("   uvicorn app.main:app --reload --port 8001")
+        logger.info("\n💡 A running AI service picks up the new embeddings on its next request")
 
 def main():
     """Parse arguments and run pre-computation."""
@@ -177,9 +266,21 @@ def main():
         type=str,
         help='Only process students from a specific class (e.g., "DSI32")'
     )
+    parser.add_argument(
+        '--student',
+        dest='student_ids',
+        action='append',
+        metavar='ID',
+        help='Only process this student, re-computing their embedding (repeatable)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Re-compute embeddings that already exist'
+    )
     
     args = parser.parse_args()
-    precompute_embeddings(args.classe)
+    precompute_embeddings(args.classe, args.student_ids, args.force)
 
 if __name__ == "__main__":
     main()
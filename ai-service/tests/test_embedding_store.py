@@ -0,0 +1,102 @@
+"""Tests for the memory-mapped embedding store."""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app.embedding_store import DTYPE, EmbeddingStore
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "embeddings.bin"), str(tmp_path / "embedding_ids.json")
+
+
+def unit_rows(count, dim=4, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_round_trip(paths):
+    vectors = unit_rows(3)
+    EmbeddingStore.open(*paths).add_many(["a", "b", "c"], vectors)
+
+    store = EmbeddingStore.open(*paths)
+    assert store.ids == ["a", "b", "c"]
+    assert len(store) == 3
+    np.testing.assert_array_equal(store.data, vectors)
+    np.testing.assert_array_equal(store["b"], vectors[1])
+    assert store.get("missing") is None
+    assert not store.is_stale()
+
+
+def test_replace_existing_id(paths):
+    vectors = unit_rows(2)
+    store = EmbeddingStore.open(*paths)
+    store.add_many(["a", "b"], vectors)
+
+    replacement = unit_rows(1, seed=1)[0]
+    store.add("a", replacement)
+
+    reopened = EmbeddingStore.open(*paths)
+    assert reopened.ids == ["a", "b"]
+    np.testing.assert_array_equal(reopened["a"], replacement)
+    np.testing.assert_array_equal(reopened["b"], vectors[1])
+
+
+def test_duplicate_ids_in_one_batch(paths):
+    store = EmbeddingStore.open(*paths)
+    store.add_many(["a"], unit_rows(1))
+
+    vectors = unit_rows(4, seed=2)
+    store.add_many(["a", "b", "a", "b"], vectors)
+
+    reopened = EmbeddingStore.open(*paths)
+    assert reopened.ids == ["a", "b"]
+    np.testing.assert_array_equal(reopened["a"], vectors[2])
+    np.testing.assert_array_equal(reopened["b"], vectors[3])
+
+
+def test_matrix_longer_than_sidecar(paths):
+    matrix_path, ids_path = paths
+    vectors = unit_rows(2)
+    EmbeddingStore.open(*paths).add_many(["a", "b"], vectors)
+
+    # Simulate an append interrupted before the sidecar was replaced
+    with open(matrix_path, "ab") as f:
+        f.write(np.ones((3, 4), dtype=DTYPE).tobytes())
+
+    store = EmbeddingStore.open(*paths)
+    assert store.ids == ["a", "b"]
+    np.testing.assert_array_equal(store.data, vectors)
+
+    extra = unit_rows(1, seed=3)
+    store.add_many(["c"], extra)
+
+    reopened = EmbeddingStore.open(*paths)
+    assert reopened.ids == ["a", "b", "c"]
+    np.testing.assert_array_equal(reopened["c"], extra[0])
+    with open(ids_path) as f:
+        assert json.load(f)["dim"] == 4
+    assert os.path.getsize(matrix_path) == 3 * 4 * DTYPE.itemsize
+
+
+def test_writes_from_another_store_are_kept(paths):
+    first = EmbeddingStore.open(*paths)
+    second = EmbeddingStore.open(*paths)
+
+    first.add_many(["a"], unit_rows(1))
+    second.add_many(["b"], unit_rows(1, seed=1))
+
+    assert EmbeddingStore.open(*paths).ids == ["a", "b"]
+
+
+def test_write_lock_is_reentrant(paths):
+    store = EmbeddingStore.open(*paths)
+    with store.write_lock():
+        store.reload()
+        store.add_many(["a"], unit_rows(1))
+
+    assert EmbeddingStore.open(*paths).ids == ["a"]
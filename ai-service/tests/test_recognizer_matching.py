@@ -0,0 +1,105 @@
+"""Tests for scoring uploads against pre-computed and session embeddings."""
+
+import numpy as np
+import pytest
+
+# The recognizer imports the full detection stack at module level
+pytest.importorskip("cv2")
+pytest.importorskip("deepface")
+
+from app.config import settings
+from app.face_recognition import FaceRecognizer
+
+DIM = 128
+
+
+def unit_rows(count, dim=DIM, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def at_distance(query, distance, seed=1):
+    """Unit vector at the given cosine distance from a unit query."""
+    noise = unit_rows(1, len(query), seed)[0]
+    noise -= np.dot(noise, query) * query
+    noise /= np.linalg.norm(noise)
+    similarity = 1.0 - distance
+    return (similarity * query + np.sqrt(1.0 - similarity ** 2) * noise).astype(np.float32)
+
+
+@pytest.fixture
+def recognizer(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDINGS_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "EMBEDDINGS_MATRIX_PATH", str(tmp_path / "embeddings.bin"))
+    monkeypatch.setattr(settings, "EMBEDDINGS_IDS_PATH", str(tmp_path / "embedding_ids.json"))
+    return FaceRecognizer()
+
+
+def stub_upload(monkeypatch, recognizer, embedding):
+    """Make every upload decode to a dummy image whose face has the given embedding."""
+    monkeypatch.setattr(recognizer, "_bytes_to_image", lambda data: (np.zeros((1, 1, 3), np.uint8), 1.0))
+    monkeypatch.setattr(recognizer, "extract_embedding", lambda image, scale=1.0: embedding)
+
+
+def test_quantized_matrix_has_one_scale(recognizer, monkeypatch):
+    monkeypatch.setattr(settings, "QUANTIZED_MATCHING", True)
+    matrix = unit_rows(50)
+    recognizer.embeddings.add_many([f"s{i}" for i in range(50)], matrix)
+    recognizer.reload_embeddings_if_changed()
+
+    index = recognizer._get_stored_index()
+    assert index.faiss_index is None
+    assert index.quantized.dtype == np.int8
+    assert index.scale.shape == ()
+    assert np.abs(index.quantized).max() == 127
+    np.testing.assert_allclose(index.quantized * index.scale, matrix, atol=float(index.scale) / 2 + 1e-7)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_quantized_match_agrees_with_float32(recognizer, monkeypatch, seed):
+    matrix = unit_rows(200, seed=seed)
+    recognizer.embeddings.add_many([f"s{i}" for i in range(200)], matrix)
+    recognizer.reload_embeddings_if_changed()
+    rows = list(range(0, 200, 3))
+    query = at_distance(matrix[rows[7]], 0.2, seed=seed + 100)
+
+    exact = 1.0 - matrix[rows] @ query
+    monkeypatch.setattr(settings, "QUANTIZED_MATCHING", True)
+    best, distance = recognizer._best_stored_match(recognizer._get_stored_index(), query, rows)
+
+    assert best == int(np.argmin(exact))
+    # The winner is rescored in float32, so the reported distance is exact
+    assert distance == pytest.approx(float(exact[best]), abs=1e-6)
+
+    monkeypatch.setattr(settings, "QUANTIZED_MATCHING", False)
+    float_best, float_distance = recognizer._best_stored_match(recognizer._get_stored_index(), query, rows)
+    assert best == float_best
+    assert distance == pytest.approx(float_distance, abs=1e-6)
+
+
+def test_session_candidate_beats_stored(recognizer, monkeypatch):
+    query = unit_rows(1, seed=3)[0]
+    recognizer.embeddings.add_many(["stored"], at_distance(query, 0.3)[None])
+    recognizer._get_session_bucket("session")["fresh"] = at_distance(query, 0.1)
+    stub_upload(monkeypatch, recognizer, query)
+
+    students = [{"id": "stored", "nom": "Stored", "image": "a"}, {"id": "fresh", "nom": "Fresh", "image": "b"}]
+    student_id, name, confidence = recognizer.recognize_face_from_bytes(b"upload", students, "session")
+
+    assert (student_id, name) == ("fresh", "Fresh")
+    assert confidence == pytest.approx(0.9, abs=1e-5)
+
+
+def test_close_stored_match_skips_session_scan(recognizer, monkeypatch):
+    query = unit_rows(1, seed=4)[0]
+    stored_distance = settings.EARLY_EXIT_THRESHOLD / 2
+    recognizer.embeddings.add_many(["stored"], at_distance(query, stored_distance)[None])
+    # Closer still, but never scored: the stored match is below EARLY_EXIT_THRESHOLD
+    recognizer._get_session_bucket("session")["fresh"] = query.copy()
+    stub_upload(monkeypatch, recognizer, query)
+
+    students = [{"id": "stored", "nom": "Stored", "image": "a"}, {"id": "fresh", "nom": "Fresh", "image": "b"}]
+    student_id, _, confidence = recognizer.recognize_face_from_bytes(b"upload", students, "session")
+
+    assert student_id == "stored"
+    assert confidence == pytest.approx(1.0 - stored_distance, abs=1e-5)